@@ -1,12 +1,26 @@
 # app.py
 import os
-from datetime import datetime
-from typing import List, Optional
+import re
+import time
+from contextlib import asynccontextmanager
+from datetime import datetime, timezone
+from typing import Annotated, Dict, List, Optional
 
-from fastapi import FastAPI, HTTPException
-from pydantic import BaseModel, EmailStr
-from sqlalchemy import create_engine, Column, Integer, String, DateTime
-from sqlalchemy.orm import declarative_base, sessionmaker
+import anyio
+import orjson
+from argon2 import PasswordHasher
+from cachetools import TTLCache
+from fastapi import Body, Depends, FastAPI, HTTPException, Path, Query
+from fastapi.responses import ORJSONResponse, Response, StreamingResponse
+from pydantic import AfterValidator, BaseModel, ConfigDict, TypeAdapter
+from sqlalchemy import Column, Integer, String, DateTime, Index, delete, event, inspect, lambda_stmt, select, text, update
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.compiler import compiles
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
+from sqlalchemy.orm import configure_mappers, declarative_base, deferred
+from sqlalchemy.sql.expression import FunctionElement
 
 # ------------- Configuración DB -------------
 DATABASE_URL = os.getenv("DATABASE_URL", "sqlite:///./dev.db")
@@ -16,6 +30,9 @@ if DATABASE_URL.startswith("postgres://"):
     DATABASE_URL = DATABASE_URL.replace("postgres://", "postgresql+psycopg://", 1)
 elif DATABASE_URL.startswith("postgresql://"):
     DATABASE_URL = DATABASE_URL.replace("postgresql://", "postgresql+psycopg://", 1)
+# SQLite local con driver asíncrono
+elif DATABASE_URL.startswith("sqlite://"):
+    DATABASE_URL = DATABASE_URL.replace("sqlite://", "sqlite+aiosqlite://", 1)
 
 # Agregar SSL si la conexión Postgres lo requiere en Render
 if DATABASE_URL.startswith("postgresql+psycopg://") and "sslmode=" not in DATABASE_URL:
@@ -25,120 +42,341 @@ if DATABASE_URL.startswith("postgresql+psycopg://") and "sslmode=" not in DATABA
 # Ajustes por motor (solo aplica a SQLite)
 connect_args = {"check_same_thread": False} if DATABASE_URL.startswith("sqlite") else {}
 
-engine = create_engine(
+# Filas por INSERT ... RETURNING en lote (insertmanyvalues)
+BULK_PAGE_SIZE = 1000
+
+# Pool dimensionado explícitamente para Postgres (el default de 5 se agota con carga)
+pool_args = (
+    {"pool_size": 20, "max_overflow": 10, "pool_recycle": 3600}
+    if DATABASE_URL.startswith("postgresql")
+    else {}
+)
+
+# Engine asíncrono: psycopg v3 soporta asyncio de forma nativa
+engine = create_async_engine(
     DATABASE_URL,
     connect_args=connect_args,
     pool_pre_ping=True,  # evita conexiones muertas tras idle
+    insertmanyvalues_page_size=BULK_PAGE_SIZE,  # filas por INSERT ... RETURNING en lote
+    **pool_args,
 )
-SessionLocal = sessionmaker(bind=engine, autoflush=False, autocommit=False)
+# SQLite local: WAL + synchronous=NORMAL evitan un fsync por cada commit
+if DATABASE_URL.startswith("sqlite"):
+    @event.listens_for(engine.sync_engine, "connect")
+    def _sqlite_pragmas(dbapi_conn, _):
+        cur = dbapi_conn.cursor()
+        cur.execute("PRAGMA journal_mode=WAL")
+        cur.execute("PRAGMA synchronous=NORMAL")
+        cur.execute("PRAGMA cache_size=-65536")
+        cur.execute("PRAGMA temp_store=MEMORY")
+        cur.close()
+
+# INSERT con soporte de ON CONFLICT según el motor
+dialect_insert = pg_insert if DATABASE_URL.startswith("postgresql") else sqlite_insert
+
+SessionLocal = async_sessionmaker(engine, class_=AsyncSession, autoflush=False, expire_on_commit=False)
 Base = declarative_base()
 
+async def get_db():
+    async with SessionLocal() as db:
+        yield db
+
 # ------------- Modelo (SQLAlchemy) -------------
+class utcnow(FunctionElement):
+    """Hora actual en UTC, sin zona horaria (mismo criterio que datetime.utcnow)."""
+    type = DateTime()
+    inherit_cache = True
+
+@compiles(utcnow, "postgresql")
+def _pg_utcnow(element, compiler, **kw):
+    # now() en una columna sin zona horaria daría la hora local de la sesión
+    return "timezone('utc', now())"
+
+@compiles(utcnow)
+def _default_utcnow(element, compiler, **kw):
+    return "CURRENT_TIMESTAMP"  # SQLite ya lo devuelve en UTC
+
 class Usuario(Base):
     __tablename__ = "usuarios"
-    id_usuario = Column(Integer, primary_key=True, index=True)
+    id_usuario = Column(Integer, primary_key=True)
     nombre = Column(String(100), nullable=False)
     correo = Column(String(150), unique=True, nullable=False)
-    password = Column(String(100), nullable=False)
-    fecha_reg = Column(DateTime, default=datetime.utcnow)
+    password = deferred(Column(String(100), nullable=False))  # fuera de los SELECT de lectura
+    fecha_reg = Column(DateTime, server_default=utcnow(), nullable=False)  # lo genera la DB
+
+    __table_args__ = (
+        # Índice cubriente para el listado paginado (index-only scan en Postgres)
+        # Solo Postgres: en SQLite quedaría como un duplicado del rowid
+        Index(
+            "ix_usuarios_id_list", "id_usuario", postgresql_include=["nombre", "correo", "fecha_reg"]
+        ).ddl_if(dialect="postgresql"),
+    )
+
+# Compilar los mappers al importar, no en la primera query
+configure_mappers()
 
-Base.metadata.create_all(bind=engine)
+# El esquema se crea una sola vez por deploy con scripts/init_db.py
+def create_schema(conn):
+    Base.metadata.create_all(conn)
+    _migrar_fecha_reg(conn)
+    # create_all no agrega índices nuevos a tablas existentes
+    for index in Usuario.__table__.indexes:
+        index.create(conn, checkfirst=True)
+
+def _migrar_fecha_reg(conn):
+    # Tablas creadas con el esquema original: fecha_reg sin DEFAULT ni NOT NULL en la DB
+    columnas = {c["name"]: c for c in inspect(conn).get_columns("usuarios")}
+    if columnas["fecha_reg"]["default"] is not None:
+        return
+    if conn.dialect.name == "postgresql":
+        conn.execute(text("UPDATE usuarios SET fecha_reg = timezone('utc', now()) WHERE fecha_reg IS NULL"))
+        conn.execute(text(
+            "ALTER TABLE usuarios"
+            " ALTER COLUMN fecha_reg SET DEFAULT timezone('utc', now()),"
+            " ALTER COLUMN fecha_reg SET NOT NULL"
+        ))
+    else:
+        # SQLite no permite ALTER COLUMN: se reconstruye la tabla
+        conn.execute(text("ALTER TABLE usuarios RENAME TO usuarios_old"))
+        Usuario.__table__.create(conn)
+        conn.execute(text(
+            "INSERT INTO usuarios (id_usuario, nombre, correo, password, fecha_reg)"
+            " SELECT id_usuario, nombre, correo, password, COALESCE(fecha_reg, CURRENT_TIMESTAMP)"
+            " FROM usuarios_old"
+        ))
+        conn.execute(text("DROP TABLE usuarios_old"))
+
+# ------------- Passwords (argon2id) -------------
+password_hasher = PasswordHasher(time_cost=2, memory_cost=64 * 1024, parallelism=1)
+
+# Máximo de usuarios por request a /bulk: cada uno requiere un hash argon2
+BULK_MAX_ITEMS = 100
+
+# Cada hash usa ~64 MiB y ~0.1 s de CPU: pocos en paralelo, aparte del threadpool general
+HASH_CONCURRENCY = 2
+_hash_limiter: Optional[anyio.CapacityLimiter] = None
+
+async def hash_password(password: str) -> str:
+    # El hash es CPU intensivo: se ejecuta en un thread para no bloquear el event loop
+    global _hash_limiter
+    if _hash_limiter is None:
+        _hash_limiter = anyio.CapacityLimiter(HASH_CONCURRENCY)
+    return await anyio.to_thread.run_sync(password_hasher.hash, password, limiter=_hash_limiter)
+
+async def hash_passwords(passwords: List[str]) -> List[str]:
+    # En paralelo acotado por _hash_limiter: con BULK_MAX_ITEMS=100 y ~0.08 s por hash,
+    # un lote tarda ~4 s en el peor caso (100 × 0.08 / HASH_CONCURRENCY)
+    hashes = [""] * len(passwords)
+
+    async def _hash(i: int, password: str):
+        hashes[i] = await hash_password(password)
+
+    async with anyio.create_task_group() as tg:
+        for i, p in enumerate(passwords):
+            tg.start_soon(_hash, i, p)
+    return hashes
 
 # ------------- Esquemas (Pydantic) -------------
+# Validación de correo con regex precompilada (más barata que email-validator)
+_EMAIL_RE = re.compile(r"[^@\s]+@[^@\s]+\.[^@\s]+")
+
+def _validar_correo(value: str) -> str:
+    if not _EMAIL_RE.fullmatch(value):
+        raise ValueError("Correo inválido")
+    local, _, dominio = value.rpartition("@")
+    return f"{local}@{dominio.lower()}"
+
+Correo = Annotated[str, AfterValidator(_validar_correo)]
+
 class UsuarioIn(BaseModel):
     nombre: str
-    correo: EmailStr
+    correo: Correo
     password: str
 
 class UsuarioOut(BaseModel):
     id_usuario: int
     nombre: str
-    correo: EmailStr
+    correo: str
     fecha_reg: datetime
-    class Config:
-        from_attributes = True
+    model_config = ConfigDict(from_attributes=True)
+
+# id válido para Integer de Postgres; los demás se rechazan sin tocar la DB
+UsuarioId = Annotated[int, Path(ge=1, le=2_147_483_647)]
+
+class UsuarioPage(BaseModel):
+    items: List[UsuarioOut]
+    next_cursor: Optional[int] = None
+
+# Adaptador precompilado: valida la lista de filas ORM en una sola pasada
+USUARIO_LIST_ADAPTER = TypeAdapter(List[UsuarioOut])
 
 class UsuarioUpdate(BaseModel):
     nombre: Optional[str] = None
-    correo: Optional[EmailStr] = None
+    correo: Optional[Correo] = None
     password: Optional[str] = None
 
+# ------------- Cache (por worker) -------------
+# GET por id; se invalida en PUT/DELETE (consistencia eventual entre workers, máx. ttl)
+_USER_CACHE = TTLCache(maxsize=10000, ttl=30)
+# Generación por id: un GET solo guarda en cache si no hubo PUT/DELETE mientras consultaba
+_USER_GEN: Dict[int, int] = {}
+
+def _invalidar_usuario(id_usuario: int):
+    _USER_GEN[id_usuario] = _USER_GEN.get(id_usuario, 0) + 1
+    _USER_CACHE.pop(id_usuario, None)
+
 # ------------- App -------------
-app = FastAPI(title="WebService UMG", version="1.0.0")
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    yield
+    await engine.dispose()
+
+app = FastAPI(
+    title="WebService UMG",
+    version="1.0.0",
+    lifespan=lifespan,
+    default_response_class=ORJSONResponse,  # serialización JSON con orjson
+)
 
 # ------------- Endpoints utilitarios -------------
+# Respuestas cacheadas por segundo: los health checks del balanceador son el tráfico más frecuente
+_HEALTH_CACHE = {"t": 0, "body": b""}
+_TIME_CACHE = {"t": 0, "body": b""}
+_CACHE_HEADERS = {"Cache-Control": "max-age=1"}
+
+def _utc_iso(ts: int) -> str:
+    return datetime.fromtimestamp(ts, timezone.utc).replace(tzinfo=None).isoformat()
+
 @app.get("/api/health")
-def health():
-    return {"status": "ok", "service": "webservice-umg", "time": datetime.utcnow().isoformat()}
+async def health():
+    now = int(time.time())
+    c = _HEALTH_CACHE
+    if c["t"] != now:
+        c["body"] = orjson.dumps({"status": "ok", "service": "webservice-umg", "time": _utc_iso(now)})
+        c["t"] = now
+    return Response(c["body"], media_type="application/json", headers=_CACHE_HEADERS)
 
 @app.get("/api/time")
-def current_time():
-    return {"utc": datetime.utcnow().isoformat()}
+async def current_time():
+    now = int(time.time())
+    c = _TIME_CACHE
+    if c["t"] != now:
+        c["body"] = orjson.dumps({"utc": _utc_iso(now)})
+        c["t"] = now
+    return Response(c["body"], media_type="application/json", headers=_CACHE_HEADERS)
 
 # ------------- CRUD Usuarios -------------
 @app.post("/api/usuarios", response_model=UsuarioOut, status_code=201)
-def crear_usuario(data: UsuarioIn):
-    db = SessionLocal()
-    try:
-        if db.query(Usuario).filter(Usuario.correo == data.correo).first():
-            raise HTTPException(status_code=409, detail="El correo ya existe")
-        u = Usuario(nombre=data.nombre, correo=data.correo, password=data.password)
-        db.add(u)
-        db.commit()
-        db.refresh(u)
-        return u
-    finally:
-        db.close()
-
-@app.get("/api/usuarios", response_model=List[UsuarioOut])
-def listar_usuarios():
-    db = SessionLocal()
-    try:
-        return db.query(Usuario).order_by(Usuario.id_usuario.asc()).all()
-    finally:
-        db.close()
+async def crear_usuario(data: UsuarioIn, db: AsyncSession = Depends(get_db)):
+    # La restricción UNIQUE de correo detecta duplicados sin un SELECT previo
+    values = data.model_dump()
+    values["password"] = await hash_password(data.password)
+    stmt = (
+        dialect_insert(Usuario)
+        .values(**values)
+        .on_conflict_do_nothing(index_elements=["correo"])
+        .returning(Usuario)
+    )
+    u = await db.scalar(stmt)
+    if u is None:
+        raise HTTPException(status_code=409, detail="El correo ya existe")
+    await db.commit()
+    return u
+
+@app.post("/api/usuarios/bulk", response_model=List[UsuarioOut], status_code=201)
+async def crear_usuarios_bulk(
+    data: Annotated[List[UsuarioIn], Body(max_length=BULK_MAX_ITEMS)],
+    db: AsyncSession = Depends(get_db),
+):
+    # Un solo INSERT ... ON CONFLICT DO NOTHING RETURNING; los correos repetidos se omiten
+    if not data:
+        return []
+    values = [u.model_dump() for u in data]
+    hashes = await hash_passwords([v["password"] for v in values])
+    for v, h in zip(values, hashes):
+        v["password"] = h
+    # Parámetros como executemany: SQLAlchemy los agrupa en lotes de insertmanyvalues_page_size
+    stmt = (
+        dialect_insert(Usuario)
+        .on_conflict_do_nothing(index_elements=["correo"])
+        .returning(Usuario.id_usuario, Usuario.nombre, Usuario.correo, Usuario.fecha_reg)
+    )
+    rows = (await db.execute(stmt, values)).all()
+    await db.commit()
+    return rows
+
+@app.get("/api/usuarios", responses={200: {"model": UsuarioPage}})
+async def listar_usuarios(
+    limit: int = Query(100, ge=1, le=1000),
+    after_id: int = 0,
+    db: AsyncSession = Depends(get_db),
+):
+    # Paginación por cursor (keyset): next_cursor es el after_id de la siguiente página
+    stmt = lambda_stmt(
+        lambda: select(Usuario)
+        .where(Usuario.id_usuario > after_id)
+        .order_by(Usuario.id_usuario.asc())
+        .limit(limit)
+    )
+    rows = (await db.scalars(stmt)).all()
+    next_cursor = rows[-1].id_usuario if len(rows) == limit else None
+    page = UsuarioPage(items=USUARIO_LIST_ADAPTER.validate_python(rows), next_cursor=next_cursor)
+    return Response(content=page.model_dump_json(), media_type="application/json")
+
+@app.get("/api/usuarios/export")
+async def exportar_usuarios():
+    # Volcado completo en NDJSON, leyendo en bloques de 500 filas
+    async def generar():
+        async with SessionLocal() as db:
+            stmt = select(Usuario).order_by(Usuario.id_usuario.asc()).execution_options(yield_per=500)
+            async for u in await db.stream_scalars(stmt):
+                yield UsuarioOut.model_validate(u).model_dump_json() + "\n"
+
+    return StreamingResponse(generar(), media_type="application/x-ndjson")
 
 @app.get("/api/usuarios/{id_usuario}", response_model=UsuarioOut)
-def obtener_usuario(id_usuario: int):
-    db = SessionLocal()
-    try:
-        u = db.get(Usuario, id_usuario)  # SQLAlchemy 2.x
-        if not u:
-            raise HTTPException(status_code=404, detail="No encontrado")
-        return u
-    finally:
-        db.close()
+async def obtener_usuario(id_usuario: UsuarioId, db: AsyncSession = Depends(get_db)):
+    hit = _USER_CACHE.get(id_usuario)
+    if hit is not None:
+        return hit
+    gen = _USER_GEN.get(id_usuario, 0)
+    # lambda_stmt cachea el SQL compilado entre requests
+    stmt = lambda_stmt(lambda: select(Usuario).where(Usuario.id_usuario == id_usuario))
+    u = await db.scalar(stmt)
+    if not u:
+        raise HTTPException(status_code=404, detail="No encontrado")
+    out = UsuarioOut.model_validate(u)
+    if _USER_GEN.get(id_usuario, 0) == gen:
+        _USER_CACHE[id_usuario] = out
+    return out
 
 @app.put("/api/usuarios/{id_usuario}", response_model=UsuarioOut)
-def actualizar_usuario(id_usuario: int, data: UsuarioUpdate):
-    db = SessionLocal()
+async def actualizar_usuario(id_usuario: UsuarioId, data: UsuarioUpdate, db: AsyncSession = Depends(get_db)):
+    # UPDATE ... RETURNING: modifica y devuelve la fila en un solo round-trip
+    changes = data.model_dump(exclude_unset=True, exclude_none=True)
+    if not changes:
+        raise HTTPException(status_code=400, detail="Nada que actualizar")
+    if "password" in changes:
+        changes["password"] = await hash_password(changes["password"])
+    stmt = update(Usuario).where(Usuario.id_usuario == id_usuario).values(**changes).returning(Usuario)
     try:
-        u = db.get(Usuario, id_usuario)
-        if not u:
-            raise HTTPException(status_code=404, detail="No encontrado")
-        if data.nombre is not None:
-            u.nombre = data.nombre
-        if data.correo is not None:
-            if db.query(Usuario).filter(Usuario.correo == data.correo, Usuario.id_usuario != id_usuario).first():
-                raise HTTPException(status_code=409, detail="El correo ya está usado por otro usuario")
-            u.correo = data.correo
-        if data.password is not None:
-            u.password = data.password
-        db.commit()
-        db.refresh(u)
-        return u
-    finally:
-        db.close()
+        u = await db.scalar(stmt, execution_options={"synchronize_session": False})
+        await db.commit()
+    except IntegrityError:
+        await db.rollback()
+        raise HTTPException(status_code=409, detail="El correo ya está usado por otro usuario")
+    _invalidar_usuario(id_usuario)
+    if u is None:
+        raise HTTPException(status_code=404, detail="No encontrado")
+    return u
 
 @app.delete("/api/usuarios/{id_usuario}", status_code=204)
-def eliminar_usuario(id_usuario: int):
-    db = SessionLocal()
-    try:
-        u = db.get(Usuario, id_usuario)
-        if not u:
-            raise HTTPException(status_code=404, detail="No encontrado")
-        db.delete(u)
-        db.commit()
-        return
-    finally:
-        db.close()
+async def eliminar_usuario(id_usuario: UsuarioId, db: AsyncSession = Depends(get_db)):
+    # DELETE directo: el conteo de filas afectadas decide entre 204 y 404
+    stmt = delete(Usuario).where(Usuario.id_usuario == id_usuario)
+    res = await db.execute(stmt, execution_options={"synchronize_session": False})
+    await db.commit()
+    _invalidar_usuario(id_usuario)
+    if res.rowcount == 0:
+        raise HTTPException(status_code=404, detail="No encontrado")
+    return Response(status_code=204)
@@ -0,0 +1,13 @@
+# scripts/init_db.py
+# Crea tablas e índices una sola vez (uso: python -m scripts.init_db)
+import asyncio
+
+from app import create_schema, engine
+
+async def main():
+    async with engine.begin() as conn:
+        await conn.run_sync(create_schema)
+    await engine.dispose()
+
+if __name__ == "__main__":
+    asyncio.run(main())